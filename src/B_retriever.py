@@ -1,120 +1,189 @@
 import os
 import re
+import shutil
+import tempfile
 import time
-import json
-import hashlib
+import sqlite3
+import importlib.util
+import pickle
+import threading
+import uuid
+import warnings
 import faiss
+import httpx
+import orjson
 import numpy as np
-import nltk
 import tiktoken
+import xxhash
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, List
 from dotenv import load_dotenv
 from tqdm import tqdm
+from langchain.retrievers import EnsembleRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import PromptTemplate
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.runnables import RunnablePassthrough
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
-nltk.download('punkt_tab')
-nltk.download('punkt')
 load_dotenv()
 
+# HNSW 인덱스 파라미터
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# 임베딩 API 동시 호출 수 (OpenAI rate limit 고려)
+EMBED_MAX_WORKERS = 8
+EMBED_MAX_RETRIES = 3
+_embed_semaphore = threading.Semaphore(EMBED_MAX_WORKERS)
+
+
+@lru_cache(maxsize=4)
+def _get_enc(model_name):
+    # 인코더 생성 비용이 크므로 모델별로 한 번만 만들어 재사용
+    return tiktoken.encoding_for_model(model_name)
+
+
+_SENT_RE = re.compile(r'(?<=[.!?])\s+')
+
 
 def split_sentences(text):
-    return re.split(r'(?<=[.!?])\s+', text.strip())
+    return _SENT_RE.split(text.strip())
+
+
+def hash_text(text):
+    # 캐시 키 용도이므로 암호학적 해시(MD5) 대신 빠른 xxh128 사용
+    return xxhash.xxh128(text.encode("utf-8")).digest()
+
+
+def open_embedding_cache(cache_file="embedding_cache.sqlite"):
+    conn = sqlite3.connect(cache_file)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, vec BLOB)")
+    return conn
+
+
+def lookup_cached_embeddings(conn, hashes):
+    if not hashes:
+        return {}
+    placeholders = ",".join("?" * len(hashes))
+    rows = conn.execute(f"SELECT hash, vec FROM cache WHERE hash IN ({placeholders})", list(hashes))
+    return {h: np.frombuffer(vec, dtype=np.float32) for h, vec in rows}
+
+
+def store_cached_embeddings(conn, entries):
+    if not entries:
+        return
+    # 새로 계산된 임베딩만 한 번의 트랜잭션으로 추가
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO cache (hash, vec) VALUES (?, ?)",
+            ((h, np.asarray(emb, dtype=np.float32).tobytes()) for h, emb in entries.items())
+        )
+
+
+def _parse_one(file_path):
+    with open(file_path, "rb") as f:
+        data = orjson.loads(f.read())
+
+    metadata = data.get("csv_metadata", {})
+    page_texts = [
+        page.get("text", "").strip()
+        for page in data.get("pdf_data", [])
+        if page.get("text", "").strip()
+    ]
+    full_text = "\n".join(page_texts)
+
+    # 검색 성능을 높이기 위해 중요한 메타데이터를 본문 텍스트 앞에 추가
+    metadata_header = (
+        f"[문서 요약 정보]\n"
+        f"- 사업명: {metadata.get('사업명', '정보 없음')}\n"
+        f"- 사업 금액: {metadata.get('사업 금액', '정보 없음')}\n"
+        f"- 발주 기관: {metadata.get('발주 기관', '정보 없음')}\n"
+        f"- 파일명: {metadata.get('파일명', '정보 없음')}\n\n"
+        f"- 사업 요약: {metadata.get('사업 요약', '정보 없음')}\n\n"
+    )
+    # 헤더와 실제 본문을 합쳐서 새로운 page_content를 만듦
+    content_with_metadata = metadata_header + full_text
+
+    if not content_with_metadata:
+        return None
+    # Document 객체를 만들 때, 메타데이터가 추가된 텍스트를 page_content로 사용
+    return Document(
+        page_content=content_with_metadata,
+        metadata={
+            "사업명": metadata.get("사업명", ""),
+            "공고번호": metadata.get("공고 번호", ""),
+            "공고차수": metadata.get("공고 차수", ""),
+            "사업금액": metadata.get("사업 금액", ""),
+            "발주기관": metadata.get("발주 기관", ""),
+            "입찰참여시작일": metadata.get("입찰 참여 시작일", ""),
+            "입찰참여마감일": metadata.get("입찰 참여 마감일", ""),
+            "사업요약": metadata.get("사업 요약", ""),
+            "파일명": metadata.get("파일명", ""),
+            "source": os.path.basename(file_path)
+        }
+    )
 
 
 def load_documents(folder_path, limit_files=None):
-    all_docs = []
-    files = sorted([f for f in os.listdir(folder_path) if f.endswith(".json")])
+    with os.scandir(folder_path) as it:
+        entries = sorted((e for e in it if e.name.endswith(".json")), key=lambda e: e.name)
     if limit_files:
-        files = files[:limit_files]
-
-    for filename in tqdm(files, desc="Loading documents"):
-        file_path = os.path.join(folder_path, filename)
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        metadata = data.get("csv_metadata", {})
-        page_texts = [
-            page.get("text", "").strip()
-            for page in data.get("pdf_data", [])
-            if page.get("text", "").strip()
-        ]
-        full_text = "\n".join(page_texts)
-
-        # 검색 성능을 높이기 위해 중요한 메타데이터를 본문 텍스트 앞에 추가
-        metadata_header = (
-            f"[문서 요약 정보]\n"
-            f"- 사업명: {metadata.get('사업명', '정보 없음')}\n"
-            f"- 사업 금액: {metadata.get('사업 금액', '정보 없음')}\n"
-            f"- 발주 기관: {metadata.get('발주 기관', '정보 없음')}\n"
-            f"- 파일명: {metadata.get('파일명', '정보 없음')}\n\n"
-            f"- 사업 요약: {metadata.get('사업 요약', '정보 없음')}\n\n"
-        )
-        # 헤더와 실제 본문을 합쳐서 새로운 page_content를 만듦
-        content_with_metadata = metadata_header + full_text
-
-        if content_with_metadata:
-            # Document 객체를 만들 때, 메타데이터가 추가된 텍스트를 page_content로 사용
-            all_docs.append(Document(
-                page_content=content_with_metadata,
-                metadata={
-                    "사업명": metadata.get("사업명", ""),
-                    "공고번호": metadata.get("공고 번호", ""),
-                    "공고차수": metadata.get("공고 차수", ""),
-                    "사업금액": metadata.get("사업 금액", ""),
-                    "발주기관": metadata.get("발주 기관", ""),
-                    "입찰참여시작일": metadata.get("입찰 참여 시작일", ""),
-                    "입찰참여마감일": metadata.get("입찰 참여 마감일", ""),
-                    "사업요약": metadata.get("사업 요약", ""),
-                    "파일명": metadata.get("파일명", ""),
-                    "source": filename
-                }
-            ))
-    return all_docs
+        entries = entries[:limit_files]
+    paths = [e.path for e in entries]
+
+    # 파일별 JSON 파싱을 여러 프로세스로 분산
+    with ProcessPoolExecutor() as ex:
+        all_docs = list(tqdm(ex.map(_parse_one, paths, chunksize=32), total=len(paths), desc="Loading documents"))
+    return [doc for doc in all_docs if doc is not None]
 
 
 def semantic_token_chunk_documents(documents, max_tokens=300, overlap_tokens=50, model_name="text-embedding-3-small"):
-    enc = tiktoken.encoding_for_model(model_name)
+    enc = _get_enc(model_name)
     chunked_docs = []
+    sep_ids = enc.encode_ordinary(" ")
 
     for doc in tqdm(documents, desc="Token-based Chunking"):
         text = doc.text if hasattr(doc, "text") else doc.page_content
         metadata = doc.metadata
-        sentences = nltk.sent_tokenize(text)
-        buffer = []
-        buffer_token_count = 0
+        sentences = split_sentences(text)
+        # 문서 단위로 한 번에 토큰화하고, 이후에는 토큰 ID 리스트만 이어 붙임
+        token_lists = enc.encode_ordinary_batch(sentences)
+        buffer_ids = []
 
-        for sentence in sentences:
-            sentence_tokens = enc.encode(sentence)
-            sentence_len = len(sentence_tokens)
+        for sentence_ids in token_lists:
+            next_ids = sep_ids + sentence_ids if buffer_ids else sentence_ids
 
-            if buffer_token_count + sentence_len <= max_tokens:
-                buffer.append(sentence)
-                buffer_token_count += sentence_len
+            if len(buffer_ids) + len(next_ids) <= max_tokens:
+                buffer_ids.extend(next_ids)
             else:
-                chunked_docs.append(Document(page_content=" ".join(buffer), metadata=metadata))
-                if overlap_tokens > 0:
-                    overlap_text = " ".join(buffer)[-overlap_tokens:]
-                    overlap_tokens_list = enc.encode(overlap_text)
-                    buffer = [enc.decode(overlap_tokens_list)] + [sentence]
-                    buffer_token_count = len(enc.encode(" ".join(buffer)))
-                else:
-                    buffer = [sentence]
-                    buffer_token_count = sentence_len
-
-        if buffer:
-            chunked_docs.append(Document(page_content=" ".join(buffer), metadata=metadata))
+                if buffer_ids:
+                    chunked_docs.append(Document(
+                        # 오버랩 경계에서 잘린 멀티바이트 문자는 제거
+                        page_content=enc.decode(buffer_ids).lstrip("\ufffd"),
+                        metadata={**metadata, "token_count": len(buffer_ids)}
+                    ))
+                overlap_ids = buffer_ids[-overlap_tokens:] if overlap_tokens > 0 else []
+                buffer_ids = overlap_ids + sep_ids + sentence_ids if overlap_ids else list(sentence_ids)
+
+        if buffer_ids:
+            chunked_docs.append(Document(
+                page_content=enc.decode(buffer_ids).lstrip("\ufffd"),
+                metadata={**metadata, "token_count": len(buffer_ids)}
+            ))
 
     return chunked_docs
 
 
-def get_retriever(documents_path, index_path="/home/data/B_faiss_db", reuse_index=True, k=5, limit_files=None):
-    start_time = time.time()
-
+def load_and_chunk_documents(documents_path, limit_files=None):
     documents = load_documents(documents_path, limit_files=limit_files)
     if not documents:
         raise ValueError("No documents found.")
@@ -127,98 +196,316 @@ def get_retriever(documents_path, index_path="/home/data/B_faiss_db", reuse_inde
     )
     if not chunks:
         raise ValueError("No chunks created.")
+    return chunks
+
+
+def _docs_from_store(faiss_db):
+    # index.pkl의 docstore에 FAISS 행 순서대로 문서가 이미 저장되어 있으므로 별도 사이드카 없이 복원
+    return [
+        faiss_db.docstore.search(faiss_db.index_to_docstore_id[i])
+        for i in range(len(faiss_db.index_to_docstore_id))
+    ]
+
+
+def _save_bm25_retriever(bm25_retriever, index_path):
+    # retriever 객체를 pickle하면 모듈 import 경로(src.B_retriever / B_retriever)에 묶이므로
+    # bm25s 모델만 자체 포맷으로 저장하고, 문서 목록은 로드 시 docstore에서 다시 붙임
+    bm25_dir = os.path.join(index_path, "bm25")
+    tmp_dir = tempfile.mkdtemp(dir=index_path, prefix=".tmp_")
+    try:
+        bm25_retriever.bm25.save(tmp_dir)
+        shutil.rmtree(bm25_dir, ignore_errors=True)
+        os.replace(tmp_dir, bm25_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _load_bm25_retriever(index_path, docs, k):
+    bm25_dir = os.path.join(index_path, "bm25")
+    if not os.path.isdir(bm25_dir):
+        return None
+    import bm25s
+
+    return BM25sRetriever(bm25=bm25s.BM25.load(bm25_dir, mmap=True), docs=docs, k=k)
+
+
+@lru_cache(maxsize=1)
+def _get_http_client():
+    # 병렬 임베딩 요청이 하나의 HTTP/2 연결 풀을 공유하도록 클라이언트를 한 번만 생성
+    # HTTP/2는 h2 패키지(httpx[http2])가 있을 때만 사용하고, 없으면 HTTP/1.1 연결 풀로 동작
+    return httpx.Client(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        timeout=60
+    )
+
+
+def embed_batch(embedding, texts):
+    # 재시도는 OpenAI 클라이언트의 max_retries(일시적 오류만 재시도)에 맡기고, 동시 호출 수만 제한
+    with _embed_semaphore:
+        return embedding.embed_documents(texts)
+
+
+def _use_gpu():
+    return hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+
+
+@lru_cache(maxsize=1)
+def _gpu_resources():
+    return faiss.StandardGpuResources()
+
+
+def save_faiss_store(faiss_db, index_path):
+    # mmap으로 열려 있는 index.faiss를 제자리에서 덮어쓰면 그 인덱스를 쓰는 프로세스가 SIGBUS로 죽으므로
+    # 임시 디렉터리에 저장한 뒤 os.replace로 교체 (기존 파일의 inode는 열려 있는 동안 그대로 유지됨)
+    os.makedirs(index_path, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=index_path, prefix=".tmp_")
+    # GPU 인덱스는 직렬화할 수 없으므로 CPU 사본으로 바꿔서 저장
+    gpu_index = None
+    if _use_gpu() and not isinstance(faiss_db.index, faiss.IndexHNSW):
+        gpu_index = faiss_db.index
+        faiss_db.index = faiss.index_gpu_to_cpu(gpu_index)
+    try:
+        faiss_db.save_local(tmp_dir)
+        for name in ("index.faiss", "index.pkl"):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(index_path, name))
+    finally:
+        if gpu_index is not None:
+            faiss_db.index = gpu_index
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class ReadOnlyFAISS(FAISS):
+    # mmap으로 연 인덱스와 프로세스 내에서 공유되는 docstore는 수정하면 안 되므로 쓰기 연산을 막음
+    def _refuse_write(self, *args, **kwargs):
+        raise ValueError("Loaded FAISS index is read-only. Rebuild it with reuse_index=False.")
+
+    add_texts = aadd_texts = add_embeddings = _refuse_write
+    delete = adelete = merge_from = _refuse_write
+
+
+def _make_faiss_store(embedding, index, docstore, index_to_docstore_id, store_cls=FAISS):
+    if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        # 예전 IndexFlatL2 인덱스는 기존 방식 그대로 사용
+        return store_cls(
+            embedding_function=embedding,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id
+        )
+    # 내적 인덱스는 normalize_L2=True로 쿼리/추가 벡터를 단위 벡터로 정규화해 코사인 유사도로 비교
+    # (LangChain은 이 조합에 대해 경고를 띄우지만 정규화 자체는 그대로 수행됨)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Normalizing L2 is not applicable")
+        return store_cls(
+            embedding_function=embedding,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            normalize_L2=True
+        )
+
+
+def build_faiss_store(texts, vectors, metadatas, embedding):
+    faiss.normalize_L2(vectors)
+    dim = vectors.shape[1]
+
+    if _use_gpu():
+        # GPU에서는 float16으로 벡터를 저장해 VRAM과 대역폭 사용량을 절반으로 줄임
+        co = faiss.GpuIndexFlatConfig()
+        co.useFloat16 = True
+        index = faiss.GpuIndexFlatIP(_gpu_resources(), dim, co)
+        index.add(vectors)
+    else:
+        # 전수 탐색(IndexFlatL2) 대신 HNSW 그래프로 근사 최근접 탐색 (정규화 벡터의 내적 = 코사인)
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.add(vectors)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    return _make_faiss_store(embedding, index, docstore, dict(enumerate(ids)))
+
+
+class BM25sRetriever(BaseRetriever):
+    # bm25s의 희소 행렬 스코어링을 LangChain retriever 인터페이스로 감싼 래퍼
+    bm25: Any
+    docs: List[Document]
+    k: int = 5
+
+    @classmethod
+    def from_documents(cls, documents, k=5):
+        # hybrid=True일 때만 필요하므로 dense 전용 사용 시 bm25s 설치 없이도 모듈을 import할 수 있게 지연 import
+        import bm25s
+
+        docs = list(documents)
+        bm25 = bm25s.BM25()
+        bm25.index(bm25s.tokenize([doc.page_content for doc in docs], show_progress=False), show_progress=False)
+        return cls(bm25=bm25, docs=docs, k=k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        import bm25s
+
+        results, scores = self.bm25.retrieve(
+            bm25s.tokenize(query, show_progress=False),
+            k=min(self.k, len(self.docs)),
+            show_progress=False
+        )
+        # retrieve는 항상 k개를 채워 반환하므로 겹치는 단어가 없는(점수 0) 문서는 제외
+        return [self.docs[i] for i, score in zip(results[0], scores[0]) if score > 0]
+
+
+# 같은 프로세스에서 같은 인덱스를 다시 열 때는 디스크 로딩을 건너뜀 (인덱스를 새로 저장하면 cache_clear)
+# 반환된 객체는 모든 호출자가 공유하므로 ReadOnlyFAISS로만 감싸서 노출
+@lru_cache(maxsize=4)
+def _read_faiss_files(index_path):
+    # IO_FLAG_MMAP은 IVF inverted list에만 적용되므로, Flat/HNSW 벡터까지 mmap하려면
+    # IO_FLAG_MMAP_IFC(faiss >= 1.11)를 사용. 구버전에서는 일반 read_index로 전체를 읽음
+    index_file = os.path.join(index_path, "index.faiss")
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC)
+    else:
+        index = faiss.read_index(index_file)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif _use_gpu():
+        co = faiss.GpuClonerOptions()
+        co.useFloat16 = True
+        index = faiss.index_cpu_to_gpu(_gpu_resources(), 0, index, co)
+
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return index, docstore, index_to_docstore_id
+
+
+def load_faiss_store(index_path, embedding):
+    # "/path/db"와 "/path/db/"가 같은 캐시 항목을 쓰도록 경로를 정규화
+    index, docstore, index_to_docstore_id = _read_faiss_files(os.path.abspath(index_path))
+    return _make_faiss_store(embedding, index, docstore, index_to_docstore_id, store_cls=ReadOnlyFAISS)
+
+
+def get_retriever(documents_path, index_path="/home/data/B_faiss_db", reuse_index=True, k=5, limit_files=None, hybrid=False):
+    start_time = time.time()
 
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY is not set.")
 
-    embedding = OpenAIEmbeddings(model="text-embedding-3-small", openai_api_key=api_key)
-    enc = tiktoken.encoding_for_model("text-embedding-3-small")
-
-    cache_file = "embedding_cache.json"
-    cache = json.load(open(cache_file, "r", encoding="utf-8")) if os.path.exists(cache_file) else {}
+    embedding = OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        openai_api_key=api_key,
+        http_client=_get_http_client(),
+        max_retries=EMBED_MAX_RETRIES
+    )
 
+    bm25_retriever = None
     if reuse_index and os.path.exists(index_path):
+        # 저장된 인덱스를 재사용할 때는 문서 로딩/청킹을 건너뜀
         print("Loading existing FAISS index...")
-        faiss_db = FAISS.load_local(index_path, embedding, allow_dangerous_deserialization=True)
+        faiss_db = load_faiss_store(index_path, embedding)
+        if hybrid:
+            bm25_retriever = _load_bm25_retriever(index_path, _docs_from_store(faiss_db), k)
     else:
-        unique_pairs = {doc.page_content.strip(): doc.metadata for doc in chunks}
-        texts = list(unique_pairs.keys())
-        metadatas = list(unique_pairs.values())
-        if not texts:
+        chunks = load_and_chunk_documents(documents_path, limit_files=limit_files)
+
+        # 본문 전체 대신 16바이트 digest로 중복 제거 (임베딩 캐시 키로도 재사용)
+        seen = {}
+        for doc in chunks:
+            text = doc.page_content.strip()
+            seen[hash_text(text)] = (text, doc.metadata)
+        if not seen:
             raise ValueError("No texts for embedding.")
 
-        filtered = [(t, m) for t, m in zip(texts, metadatas) if len(enc.encode(t)) > 2]
-        texts, metadatas = zip(*filtered) if filtered else ([], [])
+        # 청킹 단계에서 계산한 토큰 수를 그대로 사용 (재토큰화 없음)
+        filtered = [(d.hex(), t, m) for d, (t, m) in seen.items() if m["token_count"] > 2]
+        hashes, texts, metadatas = zip(*filtered) if filtered else ([], [], [])
         if not texts:
             raise ValueError("All texts filtered out.")
 
-        embeddings, new_cache_entries = [], {}
-        print("\nEmbedding in batches with caching & token safety...")
-        for i in tqdm(range(0, len(texts), 100)):
-            batch = texts[i:i + 100]
-            batch_to_embed, cache_hits = [], []
-
-            for text in batch:
-                h = hashlib.md5(text.encode("utf-8")).hexdigest()
-                if h in cache:
-                    embeddings.append(cache[h])
-                else:
-                    batch_to_embed.append(text)
-                    cache_hits.append(h)
-
-            if batch_to_embed:
-                total_tokens = sum(len(enc.encode(t)) for t in batch_to_embed)
-                if total_tokens > 280_000:
-                    mid = len(batch_to_embed) // 2
-                    embs = embedding.embed_documents(batch_to_embed[:mid]) + embedding.embed_documents(batch_to_embed[mid:])
-                else:
-                    embs = embedding.embed_documents(batch_to_embed)
-
-                for h, emb in zip(cache_hits, embs):
-                    cache[h] = emb
-                    new_cache_entries[h] = emb
-                embeddings.extend(embs)
-
-        if new_cache_entries:
-            json.dump(cache, open(cache_file, "w", encoding="utf-8"))
-
-        faiss_db = FAISS.from_embeddings(
-            text_embeddings=list(zip(texts, embeddings)),
-            embedding=embedding,
-            metadatas=metadatas
-        )
-        faiss_db.save_local(index_path)
+        cache = open_embedding_cache("embedding_cache.sqlite")
+        new_cache_entries = {}
+        # 도중에 임베딩이 실패해도 이미 받은 결과는 캐시에 저장하고 연결을 닫음
+        try:
+            # 최종 float32 행렬을 미리 할당해 두고 배치 결과를 해당 행에 바로 채움
+            vecs, jobs = None, []
+            for i in range(0, len(texts), 100):
+                batch = texts[i:i + 100]
+                batch_hashes = hashes[i:i + 100]
+                cached = lookup_cached_embeddings(cache, batch_hashes)
+                batch_to_embed, cache_hits, rows, total_tokens = [], [], [], 0
+
+                for j, (text, h, meta) in enumerate(zip(batch, batch_hashes, metadatas[i:i + 100])):
+                    if h in cached:
+                        if vecs is None:
+                            vecs = np.empty((len(texts), cached[h].shape[0]), dtype=np.float32)
+                        vecs[i + j] = cached[h]
+                    else:
+                        batch_to_embed.append(text)
+                        cache_hits.append(h)
+                        rows.append(i + j)
+                        total_tokens += meta["token_count"]
+
+                if batch_to_embed:
+                    if total_tokens > 280_000:
+                        mid = len(batch_to_embed) // 2
+                        jobs.append((batch_to_embed[:mid], cache_hits[:mid], rows[:mid]))
+                        jobs.append((batch_to_embed[mid:], cache_hits[mid:], rows[mid:]))
+                    else:
+                        jobs.append((batch_to_embed, cache_hits, rows))
+
+            print("\nEmbedding in batches with caching & token safety...")
+            with ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS) as ex:
+                # 정규화는 build_faiss_store에서 행렬 단위로 한 번만 수행
+                futures = {ex.submit(embed_batch, embedding, job[0]): job for job in jobs}
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    _, job_hashes, rows = futures[future]
+                    embs = np.asarray(future.result(), dtype=np.float32)
+                    if vecs is None:
+                        vecs = np.empty((len(texts), embs.shape[1]), dtype=np.float32)
+                    vecs[rows] = embs
+                    for h, emb in zip(job_hashes, embs):
+                        new_cache_entries[h] = emb
+        finally:
+            store_cached_embeddings(cache, new_cache_entries)
+            cache.close()
+
+        faiss_db = build_faiss_store(texts, vecs, metadatas, embedding)
+        save_faiss_store(faiss_db, index_path)
+        _read_faiss_files.cache_clear()
+        # 인덱스를 새로 만들었으므로 이전 BM25 상태는 무효화
+        shutil.rmtree(os.path.join(index_path, "bm25"), ignore_errors=True)
 
     retriever = faiss_db.as_retriever(search_type="similarity", search_kwargs={"k": k})
+    if hybrid:
+        # Dense(FAISS) + Sparse(BM25) 하이브리드 검색
+        if bm25_retriever is None:
+            # BM25도 FAISS에 들어간 것과 같은(중복 제거·strip된) 문서로 색인해야 앙상블에서 결과가 합쳐짐
+            bm25_retriever = BM25sRetriever.from_documents(_docs_from_store(faiss_db), k=k)
+            _save_bm25_retriever(bm25_retriever, index_path)
+        retriever = EnsembleRetriever(retrievers=[retriever, bm25_retriever], weights=[0.5, 0.5])
     print(f"FAISS Retriever ready in {time.time() - start_time:.2f} seconds")
     return retriever
 
 
-def enrich_documents_with_metadata(docs):
-    enriched = []
-    for doc in docs:
-        meta = doc.metadata
-        meta_text = (
-            f"[메타데이터]\n"
-            f"- 사업명: {meta.get('사업명', '')}\n"
-            f"- 공고번호: {meta.get('공고번호', '')}\n"
-            f"- 공고차수: {meta.get('공고차수', '')}\n"
-            f"- 사업금액: {meta.get('사업금액', '')}\n"
-            f"- 발주기관: {meta.get('발주기관', '')}\n"
-            f"- 입찰참여시작일: {meta.get('입찰참여시작일', '')}\n"
-            f"- 입찰참여마감일: {meta.get('입찰참여마감일', '')}\n"
-            f"- 사업요약: {meta.get('사업요약', '')}\n"
-            f"- 파일명: {meta.get('파일명', '')}\n"
-        )
-        enriched.append(meta_text + "\n" + doc.page_content)
-    return "\n\n".join(enriched)
+_META_TEMPLATE = (
+    "[메타데이터]\n"
+    "- 사업명: {사업명}\n"
+    "- 공고번호: {공고번호}\n"
+    "- 공고차수: {공고차수}\n"
+    "- 사업금액: {사업금액}\n"
+    "- 발주기관: {발주기관}\n"
+    "- 입찰참여시작일: {입찰참여시작일}\n"
+    "- 입찰참여마감일: {입찰참여마감일}\n"
+    "- 사업요약: {사업요약}\n"
+    "- 파일명: {파일명}\n"
+)
 
-
-def build_chain(retriever):
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    prompt = PromptTemplate.from_template(
-        """당신은 정부 사업 공고서를 요약해주는 비서입니다.
+_PROMPT = """당신은 정부 사업 공고서를 요약해주는 비서입니다.
 
 문맥:
 {context}
@@ -227,12 +514,23 @@ def build_chain(retriever):
 {question}
 
 답변:"""
+
+
+def enrich_documents_with_metadata(docs):
+    # 없는 키는 빈 문자열로 채워 한 번의 format_map으로 헤더 생성
+    return "\n\n".join(
+        _META_TEMPLATE.format_map(defaultdict(str, doc.metadata)) + "\n" + doc.page_content
+        for doc in docs
     )
 
+
+def build_chain(retriever):
+    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
+
     def full_chain_fn(question):
         docs = retriever.invoke(question)
         context = enrich_documents_with_metadata(docs)
-        return prompt.format(context=context, question=question)
+        return _PROMPT.format_map({"context": context, "question": question})
 
     chain = RunnablePassthrough() | full_chain_fn | llm | StrOutputParser()
     return chain